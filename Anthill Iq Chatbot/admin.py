@@ -1,11 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from typing import List, Optional
 import jwt
 from pydantic import BaseModel
-from database import get_db, User, ChatHistory
+from sqlalchemy import func
+from database import get_db, User, ChatHistory, get_daily_usage_stats, get_budget_report
 
 # Create router
 router = APIRouter(prefix="/api/admin", tags=["admin"])
@@ -37,6 +38,24 @@ class DashboardStats(BaseModel):
     total_conversations: int
     avg_response_time: float
 
+class DailyUsageResponse(BaseModel):
+    day: str
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    avg_completion_tokens: float
+    avg_latency_ms: float
+
+class BudgetReportResponse(BaseModel):
+    budget_mode: Optional[str]
+    model_name: Optional[str]
+    question_type: Optional[str]
+    requests: int
+    avg_max_tokens: float
+    avg_prompt_tokens: float
+    avg_completion_tokens: float
+    avg_latency_ms: float
+
 class UserResponse(BaseModel):
     name: str
     phone: str
@@ -101,8 +120,11 @@ async def get_stats(current_user: str = Depends(verify_token), db: Session = Dep
     ).count()
     total_conversations = db.query(ChatHistory).count()
     
-    # Calculate average response time (dummy value for now)
-    avg_response_time = 2.5  # seconds
+    # Average model latency over the last day
+    avg_latency_ms = db.query(func.avg(ChatHistory.latency_ms)).filter(
+        ChatHistory.timestamp >= datetime.utcnow() - timedelta(days=1)
+    ).scalar()
+    avg_response_time = round(float(avg_latency_ms or 0) / 1000, 2)  # seconds
     
     return {
         "total_users": total_users,
@@ -145,4 +167,21 @@ async def get_recent_conversations(
             "timestamp": conv.ChatHistory.timestamp
         }
         for conv in conversations
-    ] 
\ No newline at end of file
+    ]
+
+@router.get("/usage/daily", response_model=List[DailyUsageResponse])
+async def get_daily_usage(
+    current_user: str = Depends(verify_token),
+    db: Session = Depends(get_db),
+    days: int = Query(default=30, ge=1, le=365)
+):
+    return get_daily_usage_stats(db, days)
+
+@router.get("/usage/budget-report", response_model=List[BudgetReportResponse])
+async def get_usage_budget_report(
+    current_user: str = Depends(verify_token),
+    db: Session = Depends(get_db),
+    days: int = Query(default=30, ge=1, le=365)
+):
+    """Compare fixed (before) and adaptive (after) budgets per model and question type"""
+    return get_budget_report(db, days)
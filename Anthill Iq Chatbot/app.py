@@ -106,16 +106,19 @@ async def chat_endpoint(chat_request: ChatRequest, db: Session = Depends(get_db)
         # Process chat message
         result = await chat_manager.handle_message(
             chat_request.message,
-            str(user.id)
+            str(user.id),
+            db
         )
         
-        # Save chat history
+        # Save chat history along with token usage and latency
+        usage = result.pop("usage", None)
         add_chat_history(
             db,
             user.id,
             chat_request.message,
             result["response"],
-            session_id
+            session_id,
+            usage
         )
         
         # Add session ID to response
@@ -1,14 +1,68 @@
 from openai import OpenAI
 import os
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+from collections import defaultdict, deque
 from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from database import get_recent_output_tokens
 import re
 import json
+import math
+import random
+import time
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Fixed generation budget used before adaptive budgeting, and for the control group
+DEFAULT_MAX_TOKENS = 800
+
+# Keyword patterns used to detect the question type
+QUESTION_PATTERNS = [
+    ("greeting", r"^\s*((hi|hiya|hello|hey|there|good (morning|afternoon|evening)|thanks( a lot)?|thank you( (so|very) much)?|thx|cheers|"
+                 r"ok|okay|cool|great|bye|goodbye|see you|how are you( doing)?)\b[\s,!.?]*){1,6}$"),
+    ("booking", r"\b(book(s|ed|ing)?|reserv(e|ed|ation|ations))\b"),
+    ("pricing", r"\b(prices?|pricing|costs?|rates?|fees?|charges?|how much)\b"),
+    ("contact", r"\b(contact|phone|emails?|mail|reach)\b"),
+    ("location", r"\b(where|locations?|address(es)?|branch(es)?|directions?)\b"),
+    ("services", r"\b(services?|offices?|coworking|desks?|meetings?|events?|training|rooms?|amenities)\b"),
+]
+
+# Floor and ceiling for max_tokens per question type
+TOKEN_BUDGETS = {
+    "greeting": (60, 120),
+    "booking": (100, 200),
+    "pricing": (100, 200),
+    "contact": (100, 200),
+    "location": (150, 350),
+    "services": (200, 500),
+    "general": (250, DEFAULT_MAX_TOKENS),
+}
+
+# Length guidance added to the system prompt so the model aims below max_tokens
+LENGTH_HINTS = {
+    "greeting": "Reply in one short, friendly sentence.",
+    "booking": "Reply in one or two sentences.",
+    "pricing": "Reply in one or two sentences.",
+    "contact": "Reply in one or two sentences.",
+    "location": "Reply in at most three short sentences.",
+    "services": "Reply in a short paragraph of at most four sentences.",
+    "general": "Keep the reply to a short paragraph.",
+}
+
+# A truncated reply is counted as this multiple of its budget when sizing later budgets
+TRUNCATED_OUTPUT_FACTOR = 1.5
+
+# Number of recent replies per question type used to size the budget
+OUTPUT_HISTORY_SIZE = 50
+
+# Seconds before the recent output lengths are reloaded from the database
+OUTPUT_HISTORY_REFRESH_SECONDS = 300
+
+# Question types short enough to be served by the fast model, if one is configured
+SIMPLE_QUESTION_TYPES = {"greeting", "booking", "pricing", "contact"}
+
 class ChatManager:
     def __init__(self):
         openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -20,6 +74,17 @@ class ChatManager:
         
         print(f"Using OpenAI model: {self.model_name}")
         
+        # Adaptive generation budget settings
+        self.adaptive_budget = os.getenv("ADAPTIVE_TOKEN_BUDGET", "true").lower() in ("1", "true", "yes")
+        self.fast_model_name = os.getenv("OPENAI_FAST_MODEL")
+        
+        # Fraction of requests served with the fixed budget as a control group
+        self.fixed_sample_rate = float(os.getenv("FIXED_BUDGET_SAMPLE_RATE", "0.1"))
+        
+        # Recent completion token counts per question type, seeded from chat history
+        self.recent_output_tokens = defaultdict(lambda: deque(maxlen=OUTPUT_HISTORY_SIZE))
+        self.output_tokens_loaded_at = {}
+        
         # Store company data in memory
         self.company_data = {
             "name": "Anthill IQ",
@@ -100,6 +165,119 @@ class ChatManager:
         
         return services_text
 
+    def detect_question_type(self, message: str) -> str:
+        """Detect the question type from keywords in the message
+
+        >>> manager = ChatManager.__new__(ChatManager)
+        >>> manager.detect_question_type("ok thanks bye")
+        'greeting'
+        >>> manager.detect_question_type("Hey there, how are you?")
+        'greeting'
+        >>> manager.detect_question_type("Hey, where is the Hebbal branch?")
+        'location'
+        >>> manager.detect_question_type("How many desks can I get?")
+        'services'
+        >>> manager.detect_question_type("What is your email?")
+        'contact'
+        >>> manager.detect_question_type("What is the number of seats?")
+        'general'
+        >>> manager.detect_question_type("Do you have a meeting room in Hebbal and what does it cost?")
+        'services'
+        """
+        text = message.lower()
+        matches = [
+            question_type for question_type, pattern in QUESTION_PATTERNS
+            if re.search(pattern, text)
+        ]
+        if not matches:
+            return "general"
+        
+        # Compound questions get the largest budget of the types they touch
+        return max(matches, key=lambda question_type: TOKEN_BUDGETS[question_type][1])
+
+    def load_output_tokens(self, question_type: str, db: Session) -> None:
+        """Reload recent output lengths for a question type from chat history"""
+        loaded_at = self.output_tokens_loaded_at.get(question_type)
+        if loaded_at is not None and time.monotonic() - loaded_at < OUTPUT_HISTORY_REFRESH_SECONDS:
+            return
+        
+        # Failures also wait out the refresh window instead of retrying every request
+        self.output_tokens_loaded_at[question_type] = time.monotonic()
+        try:
+            rows = get_recent_output_tokens(db, question_type, OUTPUT_HISTORY_SIZE)
+        except Exception as e:
+            print(f"Error loading output token history: {str(e)}")
+            db.rollback()
+            return
+        
+        recent = self.recent_output_tokens[question_type]
+        recent.clear()
+        for completion_tokens, max_tokens in rows:
+            truncated = bool(max_tokens) and completion_tokens >= max_tokens
+            recent.append(self.observed_output_tokens(completion_tokens, max_tokens, truncated))
+
+    def choose_budget(self, question_type: str, db: Optional[Session] = None) -> Tuple[str, int, str]:
+        """Pick the model, max_tokens and budget mode for a question type based on recent output lengths
+
+        >>> manager = ChatManager.__new__(ChatManager)
+        >>> manager.model_name, manager.fast_model_name = "gpt-4-turbo", None
+        >>> manager.adaptive_budget, manager.fixed_sample_rate = True, 0.0
+        >>> manager.recent_output_tokens = defaultdict(deque)
+        >>> manager.choose_budget("greeting")
+        ('gpt-4-turbo', 120, 'adaptive')
+        >>> manager.recent_output_tokens["services"].extend([60, 80, 90, 100, 120])
+        >>> manager.choose_budget("services")
+        ('gpt-4-turbo', 200, 'adaptive')
+        >>> manager.recent_output_tokens["services"].extend([300, 350, 400, 500, 600])
+        >>> manager.choose_budget("services")
+        ('gpt-4-turbo', 500, 'adaptive')
+        >>> manager.adaptive_budget = False
+        >>> manager.choose_budget("services")
+        ('gpt-4-turbo', 800, 'fixed')
+        """
+        if not self.adaptive_budget or random.random() < self.fixed_sample_rate:
+            return self.model_name, DEFAULT_MAX_TOKENS, "fixed"
+        
+        if db is not None:
+            self.load_output_tokens(question_type, db)
+        
+        model = self.model_name
+        if self.fast_model_name and question_type in SIMPLE_QUESTION_TYPES:
+            model = self.fast_model_name
+        
+        floor, ceiling = TOKEN_BUDGETS[question_type]
+        recent = sorted(self.recent_output_tokens[question_type])
+        if len(recent) < 5:
+            return model, ceiling, "adaptive"
+        
+        # Leave 25% headroom above the 90th percentile of recent answers
+        p90 = recent[math.ceil(len(recent) * 0.9) - 1]
+        return model, max(floor, min(ceiling, int(p90 * 1.25))), "adaptive"
+
+    def observed_output_tokens(self, completion_tokens: int, max_tokens: int, truncated: bool) -> int:
+        """Estimate the full length of a reply, which is above the budget if it was cut off"""
+        if truncated:
+            return int(max_tokens * TRUNCATED_OUTPUT_FACTOR)
+        return completion_tokens
+
+    def record_output_tokens(self, question_type: str, completion_tokens: int, max_tokens: int, finish_reason: Optional[str]):
+        """Record an observed output length for future budgets"""
+        truncated = finish_reason == "length"
+        self.recent_output_tokens[question_type].append(
+            self.observed_output_tokens(completion_tokens, max_tokens, truncated)
+        )
+
+    def trim_to_last_sentence(self, text: str) -> str:
+        """Trim a cut-off reply back to its last complete sentence
+
+        >>> ChatManager.__new__(ChatManager).trim_to_last_sentence("We have four locations. The Hebbal branch is near")
+        'We have four locations.'
+        """
+        ends = list(re.finditer(r"[.!?](?=[\s\"')]|$)", text))
+        if not ends:
+            return text.rstrip(" ,;:-") + "..."
+        return text[:ends[-1].end()]
+
     def handle_welcome_message(self) -> Dict:
         """Handle the welcome message"""
         welcome_message = self.company_data["welcome_message"]
@@ -109,7 +287,7 @@ class ChatManager:
             "confidence": 1.0
         }
 
-    async def handle_message(self, message: str, user_id: Optional[str] = None) -> Dict:
+    async def handle_message(self, message: str, user_id: Optional[str] = None, db: Optional[Session] = None) -> Dict:
         """Handle user messages and generate responses using OpenAI"""
         
         # Handle welcome message
@@ -117,6 +295,9 @@ class ChatManager:
             result = self.handle_welcome_message()
             return result
         
+        question_type = self.detect_question_type(message)
+        model, max_tokens, budget_mode = self.choose_budget(question_type, db)
+        
         # Prepare system prompt with company data
         system_prompt = f"""You are an AI assistant for Anthill IQ, a premium workspace provider in Bangalore, India. You are friendly, empathetic, and conversational.
 
@@ -159,26 +340,63 @@ Remember to:
 - Focus on informing rather than selling
 - Never suggest or process bookings
 - Direct booking inquiries to contact the team directly
+
+Response Length:
+{LENGTH_HINTS[question_type]}
 """
 
         try:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": message}
+            ]
+            start_time = time.perf_counter()
             completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
-                max_tokens=800,
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
                 temperature=0.7
             )
             
             # Get response from OpenAI
-            response = completion.choices[0].message.content
+            choice = completion.choices[0]
+            prompt_tokens = completion.usage.prompt_tokens if completion.usage else None
+            completion_tokens = completion.usage.completion_tokens if completion.usage else None
+            if completion_tokens is not None:
+                self.record_output_tokens(question_type, completion_tokens, max_tokens, choice.finish_reason)
+            
+            # Retry a cut-off reply once with the full budget
+            if choice.finish_reason == "length" and max_tokens < DEFAULT_MAX_TOKENS:
+                max_tokens = DEFAULT_MAX_TOKENS
+                completion = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.7
+                )
+                choice = completion.choices[0]
+                if completion.usage:
+                    prompt_tokens = (prompt_tokens or 0) + completion.usage.prompt_tokens
+                    completion_tokens = (completion_tokens or 0) + completion.usage.completion_tokens
+            latency_ms = int((time.perf_counter() - start_time) * 1000)
+            
+            response = choice.message.content
+            if choice.finish_reason == "length":
+                response = self.trim_to_last_sentence(response)
             
             result = {
                 "response": response,
                 "source": "openai",
-                "confidence": 0.9
+                "confidence": 0.9,
+                "usage": {
+                    "model": model,
+                    "question_type": question_type,
+                    "budget_mode": budget_mode,
+                    "max_tokens": max_tokens,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "latency_ms": latency_ms
+                }
             }
             
             return result
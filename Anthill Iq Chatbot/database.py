@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Index, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Index, Boolean, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Dict, Optional
 import os
 from dotenv import load_dotenv
 
@@ -56,6 +57,15 @@ class ChatHistory(Base):
     message_type = Column(String(20), default='text')  # text, question, feedback, etc.
     sentiment = Column(String(20), nullable=True)  # positive, negative, neutral
     
+    # Token accounting and model latency for the generated response
+    model_name = Column(String(100), nullable=True)
+    question_type = Column(String(20), nullable=True)  # greeting, contact, location, etc.
+    budget_mode = Column(String(20), nullable=True)  # fixed, adaptive
+    max_tokens = Column(Integer, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+    
     # Relationship with User
     user = relationship('User', back_populates='chat_history')
     
@@ -63,7 +73,8 @@ class ChatHistory(Base):
     __table_args__ = (
         Index('idx_chat_user_id', 'user_id'),
         Index('idx_chat_timestamp', 'timestamp'),
-        Index('idx_chat_session', 'session_id')
+        Index('idx_chat_session', 'session_id'),
+        Index('idx_chat_question_type_timestamp', 'question_type', 'timestamp')
     )
 
 # Create all tables
@@ -93,13 +104,21 @@ def get_user_by_phone(db: SessionLocal, phone: str) -> User:
     """Get user by phone number"""
     return db.query(User).filter(User.phone == phone).first()
 
-def add_chat_history(db: SessionLocal, user_id: int, message: str, response: str, session_id: str) -> ChatHistory:
-    """Add a new chat history entry"""
+def add_chat_history(db: SessionLocal, user_id: int, message: str, response: str, session_id: str, usage: Optional[Dict] = None) -> ChatHistory:
+    """Add a new chat history entry, with optional token usage and latency"""
+    usage = usage or {}
     chat = ChatHistory(
         user_id=user_id,
         message=message,
         response=response,
-        session_id=session_id
+        session_id=session_id,
+        model_name=(usage.get("model") or "")[:100] or None,
+        question_type=usage.get("question_type"),
+        budget_mode=usage.get("budget_mode"),
+        max_tokens=usage.get("max_tokens"),
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        latency_ms=usage.get("latency_ms")
     )
     db.add(chat)
     
@@ -116,4 +135,75 @@ def get_user_chat_history(db: SessionLocal, user_id: int, limit: int = 50) -> li
     """Get chat history for a user"""
     return db.query(ChatHistory).filter(
         ChatHistory.user_id == user_id
-    ).order_by(ChatHistory.timestamp.desc()).limit(limit).all() 
\ No newline at end of file
+    ).order_by(ChatHistory.timestamp.desc()).limit(limit).all()
+
+def get_recent_output_tokens(db: SessionLocal, question_type: str, limit: int = 50) -> list:
+    """Get (completion_tokens, max_tokens) for the latest replies of a question type"""
+    rows = db.query(
+        ChatHistory.completion_tokens,
+        ChatHistory.max_tokens
+    ).filter(
+        ChatHistory.question_type == question_type,
+        ChatHistory.completion_tokens.isnot(None)
+    ).order_by(ChatHistory.timestamp.desc()).limit(limit).all()
+    
+    return [(row.completion_tokens, row.max_tokens) for row in reversed(rows)]
+
+def get_daily_usage_stats(db: SessionLocal, days: int = 30) -> list:
+    """Aggregate token counts and model latency per day"""
+    day = func.date(ChatHistory.timestamp)
+    rows = db.query(
+        day.label("day"),
+        func.count(ChatHistory.id).label("requests"),
+        func.coalesce(func.sum(ChatHistory.prompt_tokens), 0).label("prompt_tokens"),
+        func.coalesce(func.sum(ChatHistory.completion_tokens), 0).label("completion_tokens"),
+        func.avg(ChatHistory.completion_tokens).label("avg_completion_tokens"),
+        func.avg(ChatHistory.latency_ms).label("avg_latency_ms")
+    ).filter(
+        ChatHistory.timestamp >= datetime.utcnow() - timedelta(days=days),
+        ChatHistory.latency_ms.isnot(None)
+    ).group_by(day).order_by(day.desc()).all()
+    
+    return [
+        {
+            "day": str(row.day),
+            "requests": row.requests,
+            "prompt_tokens": int(row.prompt_tokens),
+            "completion_tokens": int(row.completion_tokens),
+            "avg_completion_tokens": float(row.avg_completion_tokens or 0),
+            "avg_latency_ms": float(row.avg_latency_ms or 0)
+        }
+        for row in rows
+    ]
+
+def get_budget_report(db: SessionLocal, days: int = 30) -> list:
+    """Compare average latency and tokens per budget mode, model and question type"""
+    rows = db.query(
+        ChatHistory.budget_mode,
+        ChatHistory.model_name,
+        ChatHistory.question_type,
+        func.count(ChatHistory.id).label("requests"),
+        func.avg(ChatHistory.max_tokens).label("avg_max_tokens"),
+        func.avg(ChatHistory.prompt_tokens).label("avg_prompt_tokens"),
+        func.avg(ChatHistory.completion_tokens).label("avg_completion_tokens"),
+        func.avg(ChatHistory.latency_ms).label("avg_latency_ms")
+    ).filter(
+        ChatHistory.timestamp >= datetime.utcnow() - timedelta(days=days),
+        ChatHistory.latency_ms.isnot(None)
+    ).group_by(
+        ChatHistory.budget_mode, ChatHistory.model_name, ChatHistory.question_type
+    ).order_by(ChatHistory.question_type, ChatHistory.budget_mode, ChatHistory.model_name).all()
+    
+    return [
+        {
+            "budget_mode": row.budget_mode,
+            "model_name": row.model_name,
+            "question_type": row.question_type,
+            "requests": row.requests,
+            "avg_max_tokens": float(row.avg_max_tokens or 0),
+            "avg_prompt_tokens": float(row.avg_prompt_tokens or 0),
+            "avg_completion_tokens": float(row.avg_completion_tokens or 0),
+            "avg_latency_ms": float(row.avg_latency_ms or 0)
+        }
+        for row in rows
+    ]
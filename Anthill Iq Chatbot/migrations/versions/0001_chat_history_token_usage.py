@@ -0,0 +1,36 @@
+"""Add token usage columns to chat_history
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# New chat_history columns; IF NOT EXISTS also covers tables already created by create_all
+COLUMNS = [
+    ("model_name", "VARCHAR(100)"),
+    ("question_type", "VARCHAR(20)"),
+    ("budget_mode", "VARCHAR(20)"),
+    ("max_tokens", "INTEGER"),
+    ("prompt_tokens", "INTEGER"),
+    ("completion_tokens", "INTEGER"),
+    ("latency_ms", "INTEGER"),
+]
+
+def upgrade():
+    for name, column_type in COLUMNS:
+        op.execute(f"ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS {name} {column_type}")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chat_question_type_timestamp "
+        "ON chat_history (question_type, timestamp)"
+    )
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS idx_chat_question_type_timestamp")
+    for name, _ in reversed(COLUMNS):
+        op.execute(f"ALTER TABLE chat_history DROP COLUMN IF EXISTS {name}")